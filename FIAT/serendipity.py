@@ -6,8 +6,10 @@
 #
 # Modified by David A. Ham (david.ham@imperial.ac.uk), 2019
 
-from sympy import symbols, legendre, Array, diff, lambdify
+from functools import lru_cache
+from sympy import symbols, legendre, Poly, Rational
 import numpy as np
+from numpy.polynomial.polynomial import polyder, polyvander2d, polyvander3d
 from FIAT.finite_element import FiniteElement
 from FIAT.lagrange import Lagrange
 from FIAT.dual_set import make_entity_closure_ids
@@ -27,7 +29,7 @@ def tr(n):
     if n <= 1:
         return 0
     else:
-        return int((n-3)*(n-2)/2)
+        return (n-3)*(n-2)//2
 
 
 class Serendipity(FiniteElement):
@@ -48,24 +50,9 @@ class Serendipity(FiniteElement):
         dim = flat_el.get_spatial_dimension()
         flat_topology = flat_el.get_topology()
 
-        verts = flat_el.get_vertices()
-
-        dx = ((verts[-1][0] - x)/(verts[-1][0] - verts[0][0]), (x - verts[0][0])/(verts[-1][0] - verts[0][0]))
-        dy = ((verts[-1][1] - y)/(verts[-1][1] - verts[0][1]), (y - verts[0][1])/(verts[-1][1] - verts[0][1]))
-        x_mid = 2*x-(verts[-1][0] + verts[0][0])
-        y_mid = 2*y-(verts[-1][1] + verts[0][1])
-        try:
-            dz = ((verts[-1][2] - z)/(verts[-1][2] - verts[0][2]), (z - verts[0][2])/(verts[-1][2] - verts[0][2]))
-            z_mid = 2*z-(verts[-1][2] + verts[0][2])
-        except IndexError:
-            dz = None
-            z_mid = None
-
-        VL = v_lambda_0(dim, dx, dy, dz)
-        EL = []
-        FL = []
-        IL = []
-        s_list = []
+        s_list, sizes, coeffs = serendipity_basis(flat_el.get_vertices(), degree)
+        # Dofs are numbered contiguously per entity, so hold them as ranges
+        # and only build lists for the unflattened entity_ids.
         entity_ids = {}
         cur = 0
 
@@ -75,37 +62,29 @@ class Serendipity(FiniteElement):
                 entity_ids[top_dim][entity] = []
 
         for j in sorted(flat_topology[0]):
-            entity_ids[0][j] = [cur]
+            entity_ids[0][j] = range(cur, cur + 1)
             cur = cur + 1
 
-        EL += e_lambda_0(degree, dim, dx, dy, dz, x_mid, y_mid, z_mid)
-
         for j in sorted(flat_topology[1]):
-            entity_ids[1][j] = list(range(cur, cur + degree - 1))
+            entity_ids[1][j] = range(cur, cur + degree - 1)
             cur = cur + degree - 1
 
-        FL += f_lambda_0(degree, dim, dx, dy, dz, x_mid, y_mid, z_mid)
-
         for j in sorted(flat_topology[2]):
-            entity_ids[2][j] = list(range(cur, cur + tr(degree)))
+            entity_ids[2][j] = range(cur, cur + tr(degree))
             cur = cur + tr(degree)
 
         if dim == 3:
-            IL += i_lambda_0(degree, dx, dy, dz, x_mid, y_mid, z_mid)
-
             entity_ids[3] = {}
-            entity_ids[3][0] = list(range(cur, cur + len(IL)))
-            cur = cur + len(IL)
+            entity_ids[3][0] = range(cur, cur + sizes[3])
+            cur = cur + sizes[3]
 
-        s_list = VL + EL + FL + IL
         assert len(s_list) == cur
         formdegree = 0
 
         super(Serendipity, self).__init__(ref_el=ref_el, dual=None, order=degree, formdegree=formdegree)
 
-        self.basis = {(0,)*dim: Array(s_list)}
-        self.basis_callable = {(0,)*dim: lambdify(variables[:dim], Array(s_list),
-                                                  modules="numpy", dummify=True)}
+        self.basis = {(0,)*dim: np.array(s_list, dtype=object)}
+        self.basis_coeffs = {(0,)*dim: coeffs}
         topology = ref_el.get_topology()
         unflattening_map = compute_unflattening_map(topology)
         unflattened_entity_ids = {}
@@ -119,14 +98,14 @@ class Serendipity(FiniteElement):
         for dim, entities in sorted(flat_topology.items()):
             for entity in entities:
                 unflat_dim, unflat_entity = unflattening_map[(dim, entity)]
-                unflattened_entity_ids[unflat_dim][unflat_entity] = entity_ids[dim][entity]
+                unflattened_entity_ids[unflat_dim][unflat_entity] = list(entity_ids[dim][entity])
                 unflattened_entity_closure_ids[unflat_dim][unflat_entity] = entity_closure_ids[dim][entity]
         self.entity_ids = unflattened_entity_ids
         self.entity_closure_ids = unflattened_entity_closure_ids
         self._degree = degree
         self.flat_el = flat_el
 
-        self.dual = compute_pointwise_dual(self, unisolvent_pts(ref_el, degree))
+        self.dual = compute_pointwise_dual(self, unisolvent_pts(ref_el, degree, flat_el=flat_el))
 
     def degree(self):
         return self._degree + 1
@@ -147,7 +126,13 @@ class Serendipity(FiniteElement):
 
         entity_dim, entity_id = entity
         transform = self.ref_el.get_entity_transform(entity_dim, entity_id)
-        points = list(map(transform, points))
+        # Entity transforms are affine, so recover x -> A x + b from the
+        # images of the origin and unit vectors and map all points at once.
+        points = np.asarray(points)
+        edim = points.shape[1]
+        b = np.asarray(transform(np.zeros(edim)))
+        A = np.asarray([transform(e) for e in np.eye(edim)]).reshape(edim, len(b)) - b
+        points = np.dot(points, A) + b
 
         phivals = {}
         dim = self.flat_el.get_spatial_dimension()
@@ -155,22 +140,32 @@ class Serendipity(FiniteElement):
             raise NotImplementedError('no tabulate method for serendipity elements of dimension 1 or less.')
         if dim >= 4:
             raise NotImplementedError('tabulate does not support higher dimensions than 3.')
-        points = np.asarray(points)
-        npoints, pointdim = points.shape
+        shape = self.basis_coeffs[(0,)*dim].shape
+        vander = {2: polyvander2d, 3: polyvander3d}[dim]
+        # All derivatives are stored padded to the same monomial range, so
+        # one Vandermonde matrix of the points serves every alpha and each
+        # tabulation is a single matrix product.  The coefficients are in
+        # the centred coordinates 2x - (lo + hi), so build it there too.
+        verts = self.flat_el.get_vertices()
+        centred = 2*points - np.add(verts[0], verts[-1])
+        V = vander(*centred.T, [k - 1 for k in shape[:-1]])
         for o in range(order + 1):
             alphas = mis(dim, o)
             for alpha in alphas:
+                if any(m >= k for m, k in zip(alpha, shape)):
+                    # Differentiating beyond the degree in some direction.
+                    phivals[alpha] = np.zeros((shape[-1], len(points)), dtype=V.dtype)
+                    continue
                 try:
-                    callable = self.basis_callable[alpha]
+                    coeffs = self.basis_coeffs[alpha]
                 except KeyError:
-                    polynomials = diff(self.basis[(0,)*dim], *zip(variables, alpha))
-                    callable = lambdify(variables[:dim], polynomials, modules="numpy", dummify=True)
-                    self.basis[alpha] = polynomials
-                    self.basis_callable[alpha] = callable
-                tabulation = callable(*(points[:, i] for i in range(pointdim)))
-                T = np.asarray([np.broadcast_to(tab, (npoints, ))
-                                for tab in tabulation])
-                phivals[alpha] = T
+                    coeffs = self.basis_coeffs[(0,)*dim]
+                    for axis, m in enumerate(alpha):
+                        # d/dx = 2 d/dx_mid in the centred coordinates
+                        coeffs = polyder(coeffs, m, scl=2, axis=axis)
+                    coeffs = np.pad(coeffs, [(0, k - c) for k, c in zip(shape, coeffs.shape)])
+                    self.basis_coeffs[alpha] = coeffs
+                phivals[alpha] = np.dot(coeffs.reshape(-1, shape[-1]).T, V.T)
         return phivals
 
     def entity_dofs(self):
@@ -196,6 +191,63 @@ class Serendipity(FiniteElement):
         return len(self.basis[(0,)*self.flat_el.get_spatial_dimension()])
 
 
+@lru_cache(maxsize=None)
+def serendipity_basis(verts, degree):
+    """Returns the symbolic serendipity basis on the cube with vertices
+    verts, ordered as vertex, edge, face and interior functions, the
+    number of functions of each kind, and the monomial coefficients of
+    the basis in the centred coordinates 2x - (lo + hi) etc. (see
+    :func:`monomial_coefficients`).
+    The result is cached, since every element on a given cell and degree
+    shares it."""
+    dim = len(verts[0])
+
+    dx, x_mid = coordinate_factors(verts, 0)
+    dy, y_mid = coordinate_factors(verts, 1)
+    if dim == 3:
+        dz, z_mid = coordinate_factors(verts, 2)
+    else:
+        dz = None
+        z_mid = None
+
+    # Legendre polynomials in each direction, shared by all the builders
+    Lx = [leg(j, x_mid) for j in range(degree + 1)]
+    Ly = [leg(j, y_mid) for j in range(degree + 1)]
+    Lz = [leg(j, z_mid) for j in range(degree + 1)] if dim == 3 else None
+
+    pieces = [v_lambda_0(dim, dx, dy, dz),
+              e_lambda_0(degree, dim, dx, dy, dz, Lx, Ly, Lz),
+              f_lambda_0(degree, dim, dx, dy, dz, Lx, Ly, Lz)]
+    if dim == 3:
+        pieces.append(i_lambda_0(degree, dx, dy, dz, Lx, Ly, Lz))
+    basis = []
+    for piece in pieces:
+        basis.extend(piece)
+
+    # Lower in the centred coordinates 2x - (lo + hi) etc. of the Legendre
+    # arguments, in which the monomials are well conditioned on the cell.
+    centred = {v: (v + verts[0][i] + verts[-1][i])/2
+               for i, v in enumerate(variables[:dim])}
+    coeffs = monomial_coefficients([p.xreplace(centred) for p in basis],
+                                   variables[:dim])
+    coeffs.setflags(write=False)
+    return tuple(basis), tuple(map(len, pieces)), coeffs
+
+
+def coordinate_factors(verts, i):
+    """Returns the pair of linear functions of the i-th coordinate that
+    vanish on the lower and upper faces of the cube with vertices verts
+    and are one on the opposite face, along with the shifted coordinate
+    used as the argument of the Legendre polynomials."""
+    var = variables[i]
+    lo, hi = verts[0][i], verts[-1][i]
+    # Scale by the reciprocal length rather than dividing each factor,
+    # keeping it exact on cells with integer vertices.
+    length = hi - lo
+    scale = Rational(1, length) if isinstance(length, int) else 1 / length
+    return ((hi - var)*scale, (var - lo)*scale), 2*var - (hi + lo)
+
+
 def v_lambda_0(dim, dx, dy, dz):
 
     if dim == 2:
@@ -206,46 +258,60 @@ def v_lambda_0(dim, dx, dy, dz):
     return VL
 
 
-def e_lambda_0(i, dim, dx, dy, dz, x_mid, y_mid, z_mid):
+def e_lambda_0(i, dim, dx, dy, dz, Lx, Ly, Lz):
 
     if dim == 2:
-        EL = tuple([-leg(j, y_mid) * dy[0] * dy[1] * a for a in dx for j in range(i-1)] +
-                   [-leg(j, x_mid) * dx[0] * dx[1] * b for b in dy for j in range(i-1)])
+        EL = [-Ly[j] * dy[0] * dy[1] * a for a in dx for j in range(i-1)]
+        EL.extend(-Lx[j] * dx[0] * dx[1] * b for b in dy for j in range(i-1))
     else:
-        EL = tuple([-leg(j, z_mid) * dz[0] * dz[1] * a * b for b in dx for a in dy for j in range(i-1)] +
-                   [-leg(j, y_mid) * dy[0] * dy[1] * a * c for a in dx for c in dz for j in range(i-1)] +
-                   [-leg(j, x_mid) * dx[0] * dx[1] * b * c for c in dy for b in dz for j in range(i-1)])
+        EL = [-Lz[j] * dz[0] * dz[1] * a * b for b in dx for a in dy for j in range(i-1)]
+        EL.extend(-Ly[j] * dy[0] * dy[1] * a * c for a in dx for c in dz for j in range(i-1))
+        EL.extend(-Lx[j] * dx[0] * dx[1] * b * c for c in dy for b in dz for j in range(i-1))
 
     return EL
 
 
-def f_lambda_0(i, dim, dx, dy, dz, x_mid, y_mid, z_mid):
+def f_lambda_0(i, dim, dx, dy, dz, Lx, Ly, Lz):
 
     if dim == 2:
-        FL = tuple([leg(j, x_mid) * leg(k-4-j, y_mid) * dx[0] * dx[1] * dy[0] * dy[1]
-                    for k in range(4, i + 1) for j in range(k-3)])
+        FL = [Lx[j] * Ly[k-4-j] * dx[0] * dx[1] * dy[0] * dy[1]
+              for k in range(4, i + 1) for j in range(k-3)]
     else:
-        FL = tuple([leg(j, y_mid) * leg(k-4-j, z_mid) * dy[0] * dy[1] * dz[0] * dz[1] * a
-                    for a in dx for k in range(4, i + 1) for j in range(k-3)] +
-                   [leg(j, z_mid) * leg(k-4-j, x_mid) * dx[0] * dx[1] * dz[0] * dz[1] * b
-                    for b in dy for k in range(4, i + 1) for j in range(k-3)] +
-                   [leg(j, x_mid) * leg(k-4-j, y_mid) * dx[0] * dx[1] * dy[0] * dy[1] * c
-                    for c in dz for k in range(4, i + 1) for j in range(k-3)])
+        FL = [Ly[j] * Lz[k-4-j] * dy[0] * dy[1] * dz[0] * dz[1] * a
+              for a in dx for k in range(4, i + 1) for j in range(k-3)]
+        FL.extend(Lz[j] * Lx[k-4-j] * dx[0] * dx[1] * dz[0] * dz[1] * b
+                  for b in dy for k in range(4, i + 1) for j in range(k-3))
+        FL.extend(Lx[j] * Ly[k-4-j] * dx[0] * dx[1] * dy[0] * dy[1] * c
+                  for c in dz for k in range(4, i + 1) for j in range(k-3))
 
     return FL
 
 
-def i_lambda_0(i, dx, dy, dz, x_mid, y_mid, z_mid):
+def i_lambda_0(i, dx, dy, dz, Lx, Ly, Lz):
 
-    IL = tuple([-leg(l-6-j, x_mid) * leg(j-k, y_mid) * leg(k, z_mid) *
-                dx[0] * dx[1] * dy[0] * dy[1] * dz[0] * dz[1]
-                for l in range(6, i + 1) for j in range(l-5) for k in range(j+1)])
+    IL = [-Lx[l-6-j] * Ly[j-k] * Lz[k] *
+          dx[0] * dx[1] * dy[0] * dy[1] * dz[0] * dz[1]
+          for l in range(6, i + 1) for j in range(l-5) for k in range(j+1)]
 
     return IL
 
 
-def unisolvent_pts(K, deg):
-    flat_el = flatten_reference_cube(K)
+def monomial_coefficients(polynomials, variables):
+    """Returns the monomial coefficients of a list of polynomials as an
+    array C such that C[i, j, ..., n] is the coefficient of
+    x**i * y**j * ... in the n-th polynomial."""
+    polys = [Poly(p, *variables) for p in polynomials]
+    shape = tuple(max(p.degree(v) for p in polys) + 1 for v in variables)
+    C = np.zeros(shape + (len(polys),))
+    for n, p in enumerate(polys):
+        for monom, coeff in p.terms():
+            C[monom + (n,)] = float(coeff)
+    return C
+
+
+def unisolvent_pts(K, deg, flat_el=None):
+    if flat_el is None:
+        flat_el = flatten_reference_cube(K)
     dim = flat_el.get_spatial_dimension()
     if dim == 2:
         return unisolvent_pts_quad(flat_el, deg)
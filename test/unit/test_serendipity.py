@@ -1,6 +1,7 @@
 from FIAT.reference_element import (
-    UFCQuadrilateral, UFCInterval, TensorProductCell)
+    UFCQuadrilateral, UFCHexahedron, UFCInterval, TensorProductCell)
 from FIAT import Serendipity
+from FIAT.serendipity import coordinate_factors, variables
 import numpy as np
 import sympy
 
@@ -44,3 +45,66 @@ def test_dual_tensor_versus_ufc():
     # hence form exactly the same nodes.
     for i in range(S0.space_dimension()):
         assert S0.dual.nodes[i].pt_dict == S1.dual.nodes[i].pt_dict
+
+
+def test_serendipity_high_derivatives_vanish():
+    cell = UFCQuadrilateral()
+    S = Serendipity(cell, 2)
+    points = [[0.5, 0.5], [0.25, 0.75], [0.1, 0.3]]
+    X = variables[:2]
+    tab = S.tabulate(4, points)
+    for alpha, actual in tab.items():
+        assert actual.shape == (8, 3)
+        if max(alpha) > 2:
+            assert not actual.any()
+        expect = [[sympy.diff(f, *zip(X, alpha)).subs(dict(zip(X, point)))
+                   for point in points]
+                  for f in S.basis[(0, 0)]]
+        assert np.allclose(np.asarray(expect, dtype=float), actual)
+    assert tab[(1, 1)].any() and tab[(2, 0)].any()
+
+
+def test_serendipity_symbolic_points():
+    cell = UFCQuadrilateral()
+    S = Serendipity(cell, 3)
+    X = sympy.symbols('X Y')
+    point = (0.3, 0.7)
+    symbolic = S.tabulate(1, [X])
+    numeric = S.tabulate(1, [point])
+    for alpha, actual in symbolic.items():
+        actual = [sympy.sympify(f).subs(dict(zip(X, point))) for f in actual.flat]
+        assert np.allclose(np.asarray(actual, dtype=float),
+                           numeric[alpha].flat)
+
+
+def test_serendipity_high_degree_accuracy():
+    cell = UFCQuadrilateral()
+    S = Serendipity(cell, 12)
+    X = variables[:2]
+    points = [(sympy.Rational(3, 13), sympy.Rational(11, 13)),
+              (sympy.Rational(7, 13), sympy.Rational(5, 13))]
+    for alpha, actual in S.tabulate(1, np.asarray(points, dtype=float)).items():
+        expect = [[sympy.diff(f, *zip(X, alpha)).evalf(30, subs=dict(zip(X, point)))
+                   for point in points]
+                  for f in S.basis[(0, 0)]]
+        assert np.allclose(np.asarray(expect, dtype=float), actual,
+                           rtol=0, atol=1e-12)
+
+
+def test_serendipity_hex_accuracy():
+    cell = UFCHexahedron()
+    S = Serendipity(cell, 9)
+    X = variables
+    point = (sympy.Rational(3, 13), sympy.Rational(11, 13), sympy.Rational(2, 13))
+    actual = S.tabulate(0, np.asarray([point], dtype=float))[(0, 0, 0)]
+    expect = [[f.evalf(30, subs=dict(zip(X, point)))] for f in S.basis[(0, 0, 0)]]
+    assert np.allclose(np.asarray(expect, dtype=float), actual,
+                       rtol=0, atol=1e-14)
+
+
+def test_coordinate_factors_exact_on_integer_cells():
+    x = variables[0]
+    (d0, d1), x_mid = coordinate_factors(((0, 0), (3, 3)), 0)
+    assert d0 == 1 - sympy.Rational(1, 3)*x
+    assert d1 == sympy.Rational(1, 3)*x
+    assert x_mid == 2*x - 3